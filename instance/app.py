@@ -1,13 +1,33 @@
 # app.py — Flask app with auth, DB, Socket.IO chat, REST /api/chat, and seed command
 from __future__ import annotations
 import os
-from datetime import datetime
-from flask import Flask, render_template, redirect, url_for, request, flash, jsonify
+
+# Socket.IO concurrency model: 'threading' (default, also used by `flask seed` and
+# other CLI commands) or 'eventlet'. eventlet has to monkey-patch before socket/
+# threading are imported, which the `flask` CLI has already done by the time it
+# loads this module, so only server processes should opt in. In production run one
+# `SOCKETIO_ASYNC_MODE=eventlet gunicorn -k eventlet -w 1 app:app` per process
+# behind a sticky-session load balancer, with REDIS_URL set so emits reach clients
+# connected to the other processes. Read from the process environment, not .env.
+SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
+if SOCKETIO_ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+
+import random
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from flask import Flask, render_template, redirect, url_for, request, flash, jsonify, abort, g
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_socketio import SocketIO, emit
 from dotenv import load_dotenv
+from jinja2 import FileSystemBytecodeCache
 
 from chatbot import GriefSupportBot, BotConfig
 
@@ -17,26 +37,50 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///grief_support.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    # Networked DBs (e.g. PostgreSQL): keep warm connections for mixed Socket.IO +
+    # REST load, check them before use and recycle before server-side idle timeouts
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': 20,
+        'max_overflow': 40,
+        'pool_pre_ping': True,
+        'pool_recycle': 300,
+    }
+
+# Outside debug, don't re-stat templates per render and keep compiled templates
+# on disk so new workers skip recompiling. Debug mode turns auto_reload back on.
+if not app.debug:
+    app.jinja_env.auto_reload = False
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(os.environ.get('JINJA_CACHE_DIR') or None)
 
 # --- Extensions ---
 db = SQLAlchemy(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode="threading")
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=SOCKETIO_ASYNC_MODE,
+                    message_queue=os.environ.get('REDIS_URL'))
 
 # --- Bot ---
 grief_bot = GriefSupportBot(BotConfig(deterministic=False))
 
+# Columns store naive UTC; datetime.utcnow() is deprecated
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 # --- Models ---
+# Pinned so hashing cost doesn't drift with Werkzeug upgrades; scrypt runs in OpenSSL.
+# Existing hashes keep verifying whatever method they were created with.
+PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(100), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(200), nullable=False)
-    join_date = db.Column(db.DateTime, default=datetime.utcnow)
+    join_date = db.Column(db.DateTime, default=_utcnow, server_default=db.func.current_timestamp())
 
     def set_password(self, password: str):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method=PASSWORD_HASH_METHOD)
 
     def check_password(self, password: str) -> bool:
         return check_password_hash(self.password_hash, password)
@@ -45,14 +89,14 @@ class Blog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=False)
-    date_posted = db.Column(db.DateTime, default=datetime.utcnow)
+    date_posted = db.Column(db.DateTime, default=_utcnow, server_default=db.func.current_timestamp(), index=True)
     author = db.Column(db.String(100), nullable=False)
 
 class Webinar(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=False)
-    date = db.Column(db.DateTime, nullable=False)
+    date = db.Column(db.DateTime, nullable=False, index=True)
     link = db.Column(db.String(200), nullable=False)
     host = db.Column(db.String(100), nullable=False)
 
@@ -60,6 +104,7 @@ class Course(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=False)
+    modules = db.relationship('Module', order_by='Module.order', backref='course')
 
 class Module(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -69,11 +114,18 @@ class Module(db.Model):
     order = db.Column(db.Integer, nullable=False)
 
 class CourseProgress(db.Model):
+    # One progress row per user per course; also serves the (user_id, course_id) lookups
+    __table_args__ = (db.Index('ix_cp_user_course', 'user_id', 'course_id', unique=True),)
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     course_id = db.Column(db.Integer, nullable=False)
-    completed_modules = db.Column(db.Text, default='')  # comma-separated module IDs
-    last_accessed = db.Column(db.DateTime, default=datetime.utcnow)
+    last_accessed = db.Column(db.DateTime, default=_utcnow)
+
+class CompletedModule(db.Model):
+    progress_id = db.Column(db.Integer, db.ForeignKey('course_progress.id'), primary_key=True)
+    module_id = db.Column(db.Integer, db.ForeignKey('module.id'), primary_key=True)
+    completed_at = db.Column(db.DateTime, default=_utcnow)
 
 class SelfCareRecommendation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -82,9 +134,92 @@ class SelfCareRecommendation(db.Model):
     description = db.Column(db.Text, nullable=False)
     difficulty = db.Column(db.String(20), nullable=False)  # Easy/Medium/Challenging
 
+# Backends with INSERT ... ON CONFLICT DO NOTHING; others use the savepoint fallback
+_ON_CONFLICT_DIALECTS = ('postgresql', 'sqlite')
+
+def _insert_ignore(model, *rows):
+    """Insert each row (a dict of column values) unless it hits an existing unique key."""
+    dialect = db.engine.dialect.name
+    if dialect in _ON_CONFLICT_DIALECTS:
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        db.session.execute(insert(model).on_conflict_do_nothing(), list(rows))
+        return
+    # Portable path (MySQL/MariaDB, ...): plain insert per row in a savepoint, so a
+    # duplicate only rolls back that row
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(db.insert(model), [row])
+        except IntegrityError:
+            pass
+
+def _get_or_create_progress(user_id, course_id):
+    """Return the user's CourseProgress, creating it if missing."""
+    # Insert-ignore on the unique (user_id, course_id) index: concurrent first
+    # visits share one row instead of the loser raising IntegrityError
+    _insert_ignore(CourseProgress, {'user_id': user_id, 'course_id': course_id})
+    return db.session.scalars(
+        db.select(CourseProgress).filter_by(user_id=user_id, course_id=course_id).order_by(CourseProgress.id)
+    ).first()
+
+# --- Catalog cache ---
+# Recommendations, courses and blog listings change rarely (`flask seed` runs in its own
+# process), so keep detached copies for a short TTL instead of querying per request.
+CATALOG_CACHE_TTL = int(os.environ.get('CATALOG_CACHE_TTL', 300))  # seconds
+
+def _catalog_cache(loader):
+    """Cache a catalog loader's result for CATALOG_CACHE_TTL seconds; empty results aren't kept."""
+    state = {'rows': None, 'expires': 0.0}
+
+    @wraps(loader)
+    def cached():
+        now = time.monotonic()
+        if state['rows'] is None or now >= state['expires']:
+            rows = loader()
+            # An empty catalog usually means "not seeded yet": retry on the next call
+            state['rows'] = rows or None
+            state['expires'] = now + CATALOG_CACHE_TTL
+            return rows
+        return state['rows']
+
+    cached.cache_clear = lambda: state.update(rows=None)
+    return cached
+
+@_catalog_cache
+def _load_recs():
+    recs = SelfCareRecommendation.query.all()
+    for r in recs:
+        db.session.expunge(r)
+    return tuple(recs)
+
+@_catalog_cache
+def _load_courses():
+    courses = Course.query.options(selectinload(Course.modules)).order_by(Course.id).all()
+    for c in courses:
+        for m in c.modules:
+            db.session.expunge(m)
+        db.session.expunge(c)
+    return tuple(courses)
+
+@_catalog_cache
+def _load_blogs():
+    # Listing columns only (no `content`); view_blog reads the full post from the DB
+    return tuple(db.session.execute(
+        db.select(Blog.id, Blog.title, Blog.author, Blog.date_posted).order_by(Blog.date_posted.desc())
+    ).all())
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Flask-Login already memoizes the result on g for the rest of the request
+    return db.session.get(User, int(user_id))
+
+# One timestamp per request, so every query in a view agrees on "now"
+@app.before_request
+def _stamp_request_time():
+    g.now = _utcnow()
 
 # --- Routes ---
 @app.route('/')
@@ -146,15 +281,16 @@ def logout():
 @app.route('/member/dashboard')
 @login_required
 def member_dashboard():
-    recs = SelfCareRecommendation.query.order_by(db.func.random()).limit(3).all()
-    upcoming = Webinar.query.filter(Webinar.date > datetime.utcnow()).order_by(Webinar.date).limit(2).all()
-    latest = Blog.query.order_by(Blog.date_posted.desc()).limit(3).all()
+    catalog = _load_recs()
+    recs = random.sample(catalog, min(3, len(catalog)))
+    upcoming = Webinar.query.filter(Webinar.date > g.now).order_by(Webinar.date).limit(2).all()
+    latest = _load_blogs()[:3]
     return render_template('member/dashboard.html', recommendations=recs, webinars=upcoming, blogs=latest)
 
 @app.route('/member/blogs')
 @login_required
 def member_blogs():
-    blogs = Blog.query.order_by(Blog.date_posted.desc()).all()
+    blogs = _load_blogs()
     return render_template('member/blogs.html', blogs=blogs)
 
 @app.route('/member/blog/<int:blog_id>')
@@ -166,42 +302,57 @@ def view_blog(blog_id):
 @app.route('/member/webinars')
 @login_required
 def member_webinars():
-    upcoming = Webinar.query.filter(Webinar.date > datetime.utcnow()).order_by(Webinar.date).all()
-    past = Webinar.query.filter(Webinar.date <= datetime.utcnow()).order_by(Webinar.date.desc()).all()
+    upcoming = Webinar.query.filter(Webinar.date > g.now).order_by(Webinar.date).all()
+    past = Webinar.query.filter(Webinar.date <= g.now).order_by(Webinar.date.desc()).all()
     return render_template('member/webinars.html', upcoming_webinars=upcoming, past_webinars=past)
 
 @app.route('/member/courses')
 @login_required
 def member_courses():
-    courses = Course.query.all()
+    courses = _load_courses()
     return render_template('member/courses.html', courses=courses)
 
 @app.route('/member/course/<int:course_id>')
 @login_required
 def view_course(course_id):
-    course = Course.query.get_or_404(course_id)
-    modules = Module.query.filter_by(course_id=course_id).order_by(Module.order).all()
-    progress = CourseProgress.query.filter_by(user_id=current_user.id, course_id=course_id).first()
-    if not progress:
-        progress = CourseProgress(user_id=current_user.id, course_id=course_id)
-        db.session.add(progress)
+    # Course, its modules and this user's progress in one round trip
+    row = db.session.execute(
+        db.select(Course, CourseProgress)
+        .outerjoin(CourseProgress, (CourseProgress.course_id == Course.id) & (CourseProgress.user_id == current_user.id))
+        .options(joinedload(Course.modules))
+        .filter(Course.id == course_id)
+    ).unique().first()
+    if row is None:
+        abort(404)
+    course, progress = row
+    if progress:
+        completed = set(db.session.scalars(
+            db.select(CompletedModule.module_id).filter_by(progress_id=progress.id)
+        ))
+    else:
+        _get_or_create_progress(current_user.id, course_id)
         db.session.commit()
-    completed = progress.completed_modules.split(',') if progress.completed_modules else []
-    return render_template('member/course_single.html', course=course, modules=modules, completed_modules=completed)
+        completed = set()
+    return render_template('member/course_single.html', course=course, modules=course.modules, completed_modules=completed)
 
 @app.route('/member/module/<int:module_id>')
 @login_required
 def view_module(module_id):
-    module = Module.query.get_or_404(module_id)
-    progress = CourseProgress.query.filter_by(user_id=current_user.id, course_id=module.course_id).first()
+    row = db.session.execute(
+        db.select(Module, CourseProgress, CompletedModule.module_id)
+        .outerjoin(CourseProgress, (CourseProgress.course_id == Module.course_id) & (CourseProgress.user_id == current_user.id))
+        .outerjoin(CompletedModule, (CompletedModule.progress_id == CourseProgress.id) & (CompletedModule.module_id == Module.id))
+        .filter(Module.id == module_id)
+    ).first()
+    if row is None:
+        abort(404)
+    module, progress, already_completed = row
     if not progress:
-        progress = CourseProgress(user_id=current_user.id, course_id=module.course_id)
-        db.session.add(progress)
-    completed = set(progress.completed_modules.split(',')) if progress.completed_modules else set()
-    if str(module_id) not in completed:
-        completed.add(str(module_id))
-        progress.completed_modules = ','.join(sorted([x for x in completed if x]))
-        progress.last_accessed = datetime.utcnow()
+        progress = _get_or_create_progress(current_user.id, module.course_id)
+    if already_completed is None:
+        # Single-row insert; the composite PK makes a concurrent duplicate a no-op
+        _insert_ignore(CompletedModule, {'progress_id': progress.id, 'module_id': module_id})
+        progress.last_accessed = g.now
         db.session.commit()
     return render_template('member/module_single.html', module=module)
 
@@ -222,16 +373,20 @@ def api_chat():
     return jsonify(resp), 200
 
 # --- Socket.IO events (scoped per client) ---
+_BOT_USER = 'Grief Support Bot'
+# Sent unchanged to every new connection, so built once (never mutate it)
+_GREETING_PAYLOAD = {
+    'user': _BOT_USER,
+    'message': "Hello, I'm here to support you. How are you feeling today?"
+}
+
 @socketio.on('connect')
 def handle_connect():
     if not current_user.is_authenticated:
         # Optional: reject unauthenticated socket connections
         # return False
         pass
-    emit('bot_message', {
-        'user': 'Grief Support Bot',
-        'message': "Hello, I'm here to support you. How are you feeling today?"
-    })
+    emit('bot_message', _GREETING_PAYLOAD)
 
 @socketio.on('user_message')
 def handle_user_message(data):
@@ -240,16 +395,78 @@ def handle_user_message(data):
     user_message = (data or {}).get('message', '').strip()
     if not user_message:
         return
+    # Compute the reply off the event handler so a slow bot never stalls other sockets
+    socketio.start_background_task(_respond, request.sid, user_message)
+
+def _respond(sid, user_message):
     resp = grief_bot.get_response(user_message)
-    emit('bot_message', {
-        'user': 'Grief Support Bot',
+    socketio.emit('bot_message', {
+        'user': _BOT_USER,
         'message': resp.get('text', ''),
         'category': resp.get('category', 'default')
-    })
+    }, to=sid)
 
 # --- DB setup + sample data ---
+def _backfill_completed_modules():
+    """Move ids out of the legacy comma-separated course_progress.completed_modules column."""
+    columns = {c['name'] for c in inspect(db.engine).get_columns('course_progress')}
+    if 'completed_modules' not in columns:
+        return
+    rows = db.session.execute(text(
+        "SELECT id, completed_modules FROM course_progress "
+        "WHERE completed_modules IS NOT NULL AND completed_modules != ''"
+    )).all()
+    if not rows:
+        return
+    module_ids = set(db.session.scalars(db.select(Module.id)))
+    values = [
+        {'progress_id': progress_id, 'module_id': int(mid)}
+        for progress_id, csv in rows
+        for mid in csv.split(',')
+        if mid.strip().isdigit() and int(mid) in module_ids
+    ]
+    if values:
+        _insert_ignore(CompletedModule, *values)
+    # Empty the legacy values so the copy only ever happens once
+    db.session.execute(text("UPDATE course_progress SET completed_modules = '' WHERE completed_modules != ''"))
+    db.session.commit()
+
+def _merge_duplicate_progress():
+    """Fold duplicate (user_id, course_id) progress rows into the oldest one."""
+    dupes = db.session.execute(
+        db.select(CourseProgress.user_id, CourseProgress.course_id, db.func.min(CourseProgress.id))
+        .group_by(CourseProgress.user_id, CourseProgress.course_id)
+        .having(db.func.count() > 1)
+    ).all()
+    for user_id, course_id, keep_id in dupes:
+        extra_ids = db.session.scalars(
+            db.select(CourseProgress.id)
+            .filter_by(user_id=user_id, course_id=course_id)
+            .filter(CourseProgress.id != keep_id)
+        ).all()
+        module_ids = set(db.session.scalars(
+            db.select(CompletedModule.module_id).filter(CompletedModule.progress_id.in_(extra_ids))
+        ))
+        if module_ids:
+            _insert_ignore(CompletedModule, *({'progress_id': keep_id, 'module_id': m} for m in module_ids))
+        db.session.execute(db.delete(CompletedModule).filter(CompletedModule.progress_id.in_(extra_ids)))
+        db.session.execute(db.delete(CourseProgress).filter(CourseProgress.id.in_(extra_ids)))
+    db.session.commit()
+
+def _ensure_indexes():
+    """Create declared indexes that db.create_all() skips on pre-existing tables."""
+    existing = {ix['name'] for ix in inspect(db.engine).get_indexes('course_progress')}
+    if 'ix_cp_user_course' not in existing:
+        # Older databases may hold duplicates that would block the unique index
+        _merge_duplicate_progress()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
 with app.app_context():
     db.create_all()
+    _backfill_completed_modules()
+    _ensure_indexes()
 
 @app.cli.command("seed")
 def seed():
@@ -286,14 +503,12 @@ def seed():
 
     c = Course(title="Journey Through Grief",
                description="A gentle course to companion you through grief.")
-    db.session.add(c)
-    db.session.flush()
     modules = [
-        Module(title="Understanding Grief", content="What grief is…", course_id=c.id, order=1),
-        Module(title="Common Reactions", content="Emotional, physical, behavioral…", course_id=c.id, order=2),
-        Module(title="Coping Strategies", content="Day-by-day techniques…", course_id=c.id, order=3),
-        Module(title="Finding Support", content="People and resources…", course_id=c.id, order=4),
-        Module(title="Moving Forward", content="Rebuilding and honoring…", course_id=c.id, order=5),
+        Module(title="Understanding Grief", content="What grief is…", course=c, order=1),
+        Module(title="Common Reactions", content="Emotional, physical, behavioral…", course=c, order=2),
+        Module(title="Coping Strategies", content="Day-by-day techniques…", course=c, order=3),
+        Module(title="Finding Support", content="People and resources…", course=c, order=4),
+        Module(title="Moving Forward", content="Rebuilding and honoring…", course=c, order=5),
     ]
 
     recs = [
@@ -311,7 +526,10 @@ def seed():
                                difficulty="Easy"),
     ]
 
-    db.session.add_all(blogs + webinars + modules + recs)
+    # Course and modules go through the unit of work so the FKs are filled in
+    # from the relationship; the standalone rows take the bulk insert path.
+    db.session.add_all([c] + modules)
+    db.session.bulk_save_objects(blogs + webinars + recs, return_defaults=False)
     db.session.commit()
     print("Seeded.")
 
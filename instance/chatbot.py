@@ -1,16 +1,67 @@
 # chatbot.py — Compassionate Grief Support Chatbot (hardened)
 from __future__ import annotations
+import itertools
 import random
 import re
 from dataclasses import dataclass
-from typing import Dict, List, Optional
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
 
 @dataclass
 class BotConfig:
     deterministic: bool = False  # set True for tests/demos
     locale_hint: str = "US/CA"   # placeholder if you localize crisis copy later
 
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Only messages up to this length go through the classification cache
+_CLASSIFY_CACHE_MAX_CHARS = 64
+
+# Lowercase + collapse whitespace so equivalent messages share a cache entry
+def _normalize(text: str) -> str:
+    return _WHITESPACE_RE.sub(" ", text.lower().strip())
+
+# Self-care suggestions by area (immutable; shared by all bot instances)
+_SELF_CARE_RECS: Dict[str, Tuple[str, ...]] = {
+    "physical": (
+        "Try a two-minute body scan and slow breathing; even brief regulation helps your nervous system.",
+        "A short walk or gentle stretch can release some of the tension grief holds.",
+        "Hydrate and eat something simple; basics matter when energy is low.",
+        "If you can, set a small wind-down routine tonight (lights down, no phone, one calming page)."
+    ),
+    "emotional": (
+        "Let feelings move without judging them—naming them softly can reduce their intensity.",
+        "A few lines of journaling about ‘what hurts most’ can bring relief.",
+        "It’s okay to feel moments of ease; they don’t erase your love."
+    ),
+    "social": (
+        "Text one trusted person: ‘Could you check in on me later? I’m having a rough day.’",
+        "Ask for one concrete thing (a call, a walk, a meal) instead of ‘anything.’"
+    ),
+    "spiritual": (
+        "If it helps, light a candle or sit in nature for five minutes and breathe with what’s here.",
+        "A brief mindfulness practice—counting five things you can see/hear/feel—can ground you."
+    ),
+    "practical": (
+        "Break today into the next tiny step; set a 10-minute timer and stop when it dings.",
+        "Defer big decisions; grief narrows focus—give yourself time."
+    ),
+}
+
+# Self-care area keywords, in routing priority order ("emotional" is the fallback)
+_CARE_PATTERNS: Dict[str, str] = {
+    "physical": r"\b(tired|sleep|eat|food|body|physical|exercise|walk|shower)\b",
+    "social": r"\b(people|talk|friend|family|social|alone|lonely|connection)\b",
+    "spiritual": r"\b(meaning|purpose|spiritual|faith|belief|meditation|nature|soul)\b",
+    "practical": r"\b(tasks|work|chores|overwhelmed|organize|decision|decide)\b",
+}
+
 class GriefSupportBot:
+    # --- Help-request / self-care routing patterns (precompiled once) ---
+    _HELP_RE = re.compile(r"\b(suggest|recommendation|advice|tip|help|idea|what\s+(?:can|should)\s+i\s+do)\b", re.IGNORECASE)
+    # One scan over all self-care areas; each match reports its area via lastgroup
+    _CARE_ROUTER = re.compile("|".join(f"(?P<{k}>{p})" for k, p in _CARE_PATTERNS.items()), re.IGNORECASE)
+
     def __init__(self, config: Optional[BotConfig] = None):
         self.cfg = config or BotConfig()
         if self.cfg.deterministic:
@@ -92,22 +143,22 @@ class GriefSupportBot:
             "self_care": ["What’s one tiny step you could take in the next ten minutes?", "Who could text you a check-in later today?"],
         }
 
-        # --- Pattern bank (precompiled) ---
+        # --- Pattern bank (source strings, compiled into one dispatcher below) ---
         def c(p: str) -> re.Pattern:
             return re.compile(p, re.IGNORECASE)
 
-        self.patterns: Dict[str, re.Pattern] = {
-            "greeting": c(r"\b(hello|hi|hey|greetings)\b"),
-            "feeling_bad": c(r"\b(sad|depressed|overwhelmed|exhausted|tired|down|lonely|alone|lost|cry(?:ing)?|tears|difficult|hard)\b"),
-            "feeling_better": c(r"\b(better|good|okay|ok|fine|alright|improving|hopeful|positive)\b"),
-            "memories": c(r"(?:\bmemory\b|\bmemories\b|\bremember(?:ed)?\b|\bmiss(?:ing)?\b|loved\s+one)"),
-            "sleep_issues": c(r"\b(sleep|insomnia|nightmares?|dreams?|awake|bed)\b"),
-            "anniversary": c(r"\b(anniversary|birthday|holiday|christmas|thanksgiving|special\s+day|year\s+since|month\s+since)\b"),
-            "guilt": c(r"(?:\bguilt(?:y)?\b|\bblame(?:d)?\b|\bfault\b|\bregret\b|should(?:\s+have)?|could(?:\s+have)?|would(?:\s+have)?|\bif only\b|\bsorry\b)"),
-            "anger": c(r"\b(angry|anger|mad|unfair|cruel|hate|resent(?:ment)?)\b"),
-            "self_care": c(r"(?:self[-\s]?care|take\s+care|help\s+myself|\b(shower|eat|eating|food|exercise|walk)\b)"),
-            "support": c(r"\b(support|friend[s]?|family|help|talk(?:ing)?|listen(?:ing)?)\b"),
-            "professional_help": c(r"\b(therapy|therapist|counsel(?:l)?ing|counsel(?:l)?or|professional|doctor|psychologist|psychiatrist)\b"),
+        self.patterns: Dict[str, str] = {
+            "greeting": r"\b(hello|hi|hey|greetings)\b",
+            "feeling_bad": r"\b(sad|depressed|overwhelmed|exhausted|tired|down|lonely|alone|lost|cry(?:ing)?|tears|difficult|hard)\b",
+            "feeling_better": r"\b(better|good|okay|ok|fine|alright|improving|hopeful|positive)\b",
+            "memories": r"(?:\bmemory\b|\bmemories\b|\bremember(?:ed)?\b|\bmiss(?:ing)?\b|loved\s+one)",
+            "sleep_issues": r"\b(sleep|insomnia|nightmares?|dreams?|awake|bed)\b",
+            "anniversary": r"\b(anniversary|birthday|holiday|christmas|thanksgiving|special\s+day|year\s+since|month\s+since)\b",
+            "guilt": r"(?:\bguilt(?:y)?\b|\bblame(?:d)?\b|\bfault\b|\bregret\b|should(?:\s+have)?|could(?:\s+have)?|would(?:\s+have)?|\bif only\b|\bsorry\b)",
+            "anger": r"\b(angry|anger|mad|unfair|cruel|hate|resent(?:ment)?)\b",
+            "self_care": r"(?:self[-\s]?care|take\s+care|help\s+myself|\b(shower|eat|eating|food|exercise|walk)\b)",
+            "support": r"\b(support|friend[s]?|family|help|talk(?:ing)?|listen(?:ing)?)\b",
+            "professional_help": r"\b(therapy|therapist|counsel(?:l)?ing|counsel(?:l)?or|professional|doctor|psychologist|psychiatrist)\b",
         }
 
         # Suicide / self-harm crisis patterns (evaluated first)
@@ -132,8 +183,29 @@ class GriefSupportBot:
             "default",
         ]
 
-        # Track recent reply usage per category (reduce repetition)
-        self._used_indexes: Dict[str, set] = {}
+        # Rank per category (lower wins) for _pick_by_priority
+        self._prio: Dict[str, int] = {cat: i for i, cat in enumerate(self.priorities)}
+
+        # All categories as one alternation of named groups, so a single scan
+        # finds every hit. Ordered by priority: where two categories could match
+        # the same text, the alternative listed first (the preferred one) wins.
+        self.category_pattern = c("|".join(
+            f"(?P<{cat}>{self.patterns[cat]})" for cat in self.priorities if cat in self.patterns
+        ))
+
+        # Classification depends only on the normalized text, so short repeats
+        # ("hi", "thanks", ...) skip the regex scans; reply choice stays live.
+        # Longer messages are classified directly and never kept in memory.
+        self._classify = lru_cache(maxsize=512)(self._classify_text)
+
+        # Rotate through each category's replies (reduce repetition); outside
+        # deterministic mode the rotation order is shuffled once per category
+        self._cycles: Dict[str, Iterator[int]] = {}
+        for cat, bank in self.responses.items():
+            order = list(range(len(bank)))
+            if not self.cfg.deterministic:
+                random.shuffle(order)
+            self._cycles[cat] = itertools.cycle(order)
 
     # --- Public API ---
     def get_response(self, message: str) -> Dict[str, str]:
@@ -141,51 +213,53 @@ class GriefSupportBot:
         if not text:
             return self._pack("default", "I’m here. Say anything that feels manageable to share.")
 
-        # Crisis check first
-        if self.crisis_pattern.search(text):
-            return self._pack("crisis", self._choose("crisis"), matched="crisis")
+        normalized = _normalize(text)
+        if len(normalized) <= _CLASSIFY_CACHE_MAX_CHARS:
+            category, matched, care_area = self._classify(normalized)
+        else:
+            category, matched, care_area = self._classify_text(normalized)
 
-        # Allow multiple category hits, then pick by priority
-        hits = self._match_categories(text)
-        category = self._pick_by_priority(hits) if hits else "default"
+        if category == "crisis":
+            return self._pack("crisis", self._choose("crisis"), matched=matched)
 
         # Smart self-care suggestion if explicitly asked
-        if self._explicit_help_request(text):
-            suggestion = self._get_self_care_suggestion(text)
-            return self._pack("self_care", suggestion, matched="self_care(help)")
+        if care_area:
+            return self._pack("self_care", self._get_self_care_suggestion(care_area), matched=matched)
 
         base = self._choose(category)
         fu = self._choose_followup(category)
         reply = f"{base} {fu}" if fu else base
-        return self._pack(category, reply, matched=",".join(sorted(hits)) if hits else "")
+        return self._pack(category, reply, matched=matched)
 
     # --- Internals ---
+    # -> (category, matched_terms, self-care area or "") for normalized text
+    def _classify_text(self, text: str) -> Tuple[str, str, str]:
+        # Crisis check first
+        if self.crisis_pattern.search(text):
+            return "crisis", "crisis", ""
+
+        if self._explicit_help_request(text):
+            return "self_care", "self_care(help)", self._care_area(text)
+
+        # Allow multiple category hits, then pick by priority
+        hits = self._match_categories(text)
+        if not hits:
+            return "default", "", ""
+        return self._pick_by_priority(hits), ",".join(sorted(hits)), ""
+
     def _match_categories(self, text: str) -> set:
-        hits = set()
-        for cat, pat in self.patterns.items():
-            if pat.search(text):
-                hits.add(cat)
-        return hits
+        return {m.lastgroup for m in self.category_pattern.finditer(text) if m.lastgroup}
 
     def _pick_by_priority(self, hits: set) -> str:
-        for cat in self.priorities:
-            if cat in hits:
-                return cat
-        return "default"
+        return min(hits, key=lambda c: self._prio.get(c, len(self._prio)), default="default")
 
     def _explicit_help_request(self, text: str) -> bool:
-        return re.search(r"\b(suggest|recommendation|advice|tip|help|idea|what\s+(?:can|should)\s+i\s+do)\b", text, re.IGNORECASE) is not None
+        return self._HELP_RE.search(text) is not None
 
     def _choose(self, category: str) -> str:
-        bank = self.responses.get(category, self.responses["default"])
-        used = self._used_indexes.setdefault(category, set())
-        choices = [i for i in range(len(bank)) if i not in used]
-        if not choices:
-            used.clear()
-            choices = list(range(len(bank)))
-        idx = choices[0] if self.cfg.deterministic else random.choice(choices)
-        used.add(idx)
-        return bank[idx]
+        if category not in self.responses:
+            category = "default"
+        return self.responses[category][next(self._cycles[category])]
 
     def _choose_followup(self, category: str) -> str:
         bank = self.followups.get(category)
@@ -197,50 +271,15 @@ class GriefSupportBot:
         return {"text": text, "category": category, "matched_terms": matched}
 
     # --- Self-care suggestions ---
-    def _get_self_care_suggestion(self, message: str) -> str:
-        m = message.lower()
-        if re.search(r"\b(tired|sleep|eat|food|body|physical|exercise|walk|shower)\b", m):
-            cat = "physical"
-        elif re.search(r"\b(people|talk|friend|family|social|alone|lonely|connection)\b", m):
-            cat = "social"
-        elif re.search(r"\b(meaning|purpose|spiritual|faith|belief|meditation|nature|soul)\b", m):
-            cat = "spiritual"
-        elif re.search(r"\b(tasks|work|chores|overwhelmed|organize|decision|decide)\b", m):
-            cat = "practical"
-        else:
-            cat = "emotional"
+    def _care_area(self, message: str) -> str:
+        found = {m.lastgroup for m in self._CARE_ROUTER.finditer(message)}
+        return next((c for c in _CARE_PATTERNS if c in found), "emotional")
 
-        recs = self._self_care_recs()[cat]
+    def _get_self_care_suggestion(self, area: str) -> str:
+        recs = _SELF_CARE_RECS[area]
         suggestion = recs[0] if self.cfg.deterministic else random.choice(recs)
         return f"It sounds like you could use support. {suggestion} Would you like another suggestion?"
 
-    def _self_care_recs(self) -> Dict[str, List[str]]:
-        return {
-            "physical": [
-                "Try a two-minute body scan and slow breathing; even brief regulation helps your nervous system.",
-                "A short walk or gentle stretch can release some of the tension grief holds.",
-                "Hydrate and eat something simple; basics matter when energy is low.",
-                "If you can, set a small wind-down routine tonight (lights down, no phone, one calming page)."
-            ],
-            "emotional": [
-                "Let feelings move without judging them—naming them softly can reduce their intensity.",
-                "A few lines of journaling about ‘what hurts most’ can bring relief.",
-                "It’s okay to feel moments of ease; they don’t erase your love."
-            ],
-            "social": [
-                "Text one trusted person: ‘Could you check in on me later? I’m having a rough day.’",
-                "Ask for one concrete thing (a call, a walk, a meal) instead of ‘anything.’"
-            ],
-            "spiritual": [
-                "If it helps, light a candle or sit in nature for five minutes and breathe with what’s here.",
-                "A brief mindfulness practice—counting five things you can see/hear/feel—can ground you."
-            ],
-            "practical": [
-                "Break today into the next tiny step; set a 10-minute timer and stop when it dings.",
-                "Defer big decisions; grief narrows focus—give yourself time."
-            ],
-        }
-
 # Optional: quick manual test
 if __name__ == "__main__":
     bot = GriefSupportBot(BotConfig(deterministic=True))